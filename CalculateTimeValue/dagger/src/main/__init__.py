@@ -25,7 +25,18 @@ Example Call:
 
 from dagger import function, object_type, Secret
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import asyncio
 import json
+import numpy as np
+
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=Retry(total=3, backoff_factor=0.3)))
+
+def _fv_schedule(amount: float, adjusted_rate: float, max_period: int) -> np.ndarray:
+    """Returns the future value of amount at the end of each year, compounding with a running product."""
+    return amount * np.cumprod(np.full(max_period, 1 + adjusted_rate))
 
 @object_type
 class CalculateTimeValue:
@@ -38,11 +49,11 @@ class CalculateTimeValue:
     
     async def get_inflation(self, series_id: str, fred_str: Secret) -> float:
         api_key =  await fred_str.plaintext()
-        url = f"https://api.stlouisfed.org/fred/series/observations?series_id={series_id}&api_key={api_key}&file_type=json"
-        response = requests.get(url)
+        url = f"https://api.stlouisfed.org/fred/series/observations?series_id={series_id}&api_key={api_key}&file_type=json&sort_order=desc&limit=13"
+        response = await asyncio.to_thread(session.get, url, timeout=10)
         data = response.json()
-        latest_observation = data['observations'][-1]
-        previous_year_observation = data['observations'][-13] if len(data['observations']) > 12 else None
+        latest_observation = data['observations'][0]
+        previous_year_observation = data['observations'][12] if len(data['observations']) > 12 else None
         if previous_year_observation:
             latest_cpi = float(latest_observation['value'])
             previous_cpi = float(previous_year_observation['value'])
@@ -54,25 +65,16 @@ class CalculateTimeValue:
         return inflation_rate_str
 
     def calculate_time_value(self, max_period, inflation, amount, calculation_type, interest_rate_or_return) -> str:
-        results = []
+        if calculation_type == 'debt':
+            value_key = "future_value_debt"
+        elif calculation_type == 'stock':
+            value_key = "future_value_stock"
+        else:
+            raise ValueError("Invalid calculation type. Must be 'debt' or 'stock'.")
 
-        for year in range(1, max_period + 1):
-            if calculation_type == 'debt':
-                adjusted_rate = (1 + interest_rate_or_return) / (1 + inflation) - 1
-                future_value = amount * (1 + adjusted_rate) ** year
-                results.append({
-                    "year": year,
-                    "future_value_debt": round(future_value, 2)
-                })
-            elif calculation_type == 'stock':
-                adjusted_rate = (1 + interest_rate_or_return) / (1 + inflation) - 1
-                future_value = amount * (1 + adjusted_rate) ** year
-                results.append({
-                    "year": year,
-                    "future_value_stock": round(future_value, 2)
-                })
-            else:
-                raise ValueError("Invalid calculation type. Must be 'debt' or 'stock'.")
+        adjusted_rate = (1 + interest_rate_or_return) / (1 + inflation) - 1
+        future_values = np.round(_fv_schedule(amount, adjusted_rate, max_period), 2)
+        results = [{"year": year, value_key: float(future_value)} for year, future_value in enumerate(future_values, start=1)]
 
         result_json = json.dumps(results)
-        return result_json
\ No newline at end of file
+        return result_json
@@ -23,94 +23,116 @@ dagger call stocks --sectors_of_interest="Health Care,Information Technology,Fin
 from dagger import function, object_type
 from bs4 import BeautifulSoup
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
+import numpy as np
 from io import StringIO
+import asyncio
 import json
+import orjson
 import yfinance as yf
 
+MAX_FETCH_WORKERS = 12
+
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=Retry(total=3, backoff_factor=0.3)))
+
 @object_type
 class GetStocks:
     @function
     async def stocks(self, sectors_of_interest: str, period: int) -> str:
         investment_options = await self.get_investment_options(sectors_of_interest, period)
         investment_df = pd.DataFrame(investment_options)
+        if investment_df.empty:
+            return '{"investments": []}'
         investment_df = investment_df.sort_values(by=['industry', 'average_return'], ascending=[True, False])
         investments_json = investment_df.to_dict(orient='records')
         for investment in investments_json:
             investment['average_return'] = str(investment['average_return'])
-        return json.dumps({"investments": investments_json})
+        return orjson.dumps({"investments": investments_json}, option=orjson.OPT_SERIALIZE_NUMPY).decode()
     
-    def sp500(self, sectors_of_interest_list) -> str:
+    async def sp500(self, sectors_of_interest_list) -> str:
+        symbols_and_industries = await self._sp500_raw(sectors_of_interest_list)
+        return json.dumps({"symbols_and_industries": symbols_and_industries})
+
+    async def _sp500_raw(self, sectors_of_interest_list) -> list[dict]:
         url = 'https://en.wikipedia.org/wiki/List_of_S%26P_500_companies'
         try:
-            response = requests.get(url)
+            response = await asyncio.to_thread(session.get, url, timeout=10)
             response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
+            soup = BeautifulSoup(response.text, 'lxml')
             table = soup.find('table', {'id': 'constituents'})
             table_html = str(table)
-            df = pd.read_html(StringIO(table_html))[0]
-            df_filtered = df[df['GICS Sector'].isin(sectors_of_interest_list)]
-            symbols = df_filtered['Symbol'].tolist()
-            industries = df_filtered['GICS Sector'].tolist()
-            symbols_and_industries = [{"symbol": symbol, "industry": industry} for symbol, industry in zip(symbols, industries)]
-            return json.dumps({"symbols_and_industries": symbols_and_industries})
+            df = pd.read_html(StringIO(table_html))[0][['Symbol', 'GICS Sector']]
+            df_filtered = df.loc[df['GICS Sector'].isin(set(sectors_of_interest_list))]
+            return [{"symbol": symbol, "industry": industry} for symbol, industry in df_filtered.itertuples(index=False, name=None)]
 
         except requests.exceptions.RequestException as e:
             print(f"Request error: {e}")
         except ValueError as e:
             print(f"Error parsing table: {e}")
-        return json.dumps({"symbols": []})
+        return []
     
-    async def get_historical_data(self, symbol: str, period: int) -> pd.DataFrame:
+    def get_historical_data(self, symbols: list, period: int) -> pd.DataFrame:
+        """Fetches monthly price history for all symbols in one batched yfinance download, grouped by ticker."""
         try:
-            stock = yf.Ticker(symbol)
             period_str = f"{period}y"
-            df = stock.history(period=period_str, interval="1mo")
+            df = yf.download(symbols, period=period_str, interval="1mo", group_by="ticker", auto_adjust=True, threads=MAX_FETCH_WORKERS, progress=False, timeout=10)
             return df
         except Exception as e:
-            print(f"Error fetching data for {symbol}: {e}")
+            print(f"Error fetching data for {len(symbols)} symbols: {e}")
             return pd.DataFrame()
 
-    def calculate_returns(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Calculates the monthly return and adds it to the DataFrame."""
-        try:
-            df['monthly_return'] = df['Close'].pct_change()
-            return df
-        except Exception as e:
-            print(f"Error calculating returns: {e}")
-            return df
-        
-    def calculate_avg_return(self, df: pd.DataFrame) -> float:
-        """Calculates the average annual return for a given DataFrame of historical data."""
-        try:
-            average_monthly_return = df['monthly_return'].mean()
-            average_annual_return = (1 + average_monthly_return) ** 12 - 1 
-            return average_annual_return
-        except Exception as e:
-            print(f"Error calculating average return: {e}")
-            return float('nan')
-                
+    def calculate_returns(self, closes: pd.DataFrame) -> pd.DataFrame:
+        """Calculates the monthly returns for every symbol at once from a (months x symbols) frame of closing prices. The rows are the union of all symbols' dates, so each column is forward-filled across its own gaps and the missing months masked again, matching pct_change over that symbol's closes alone."""
+        prices = closes.to_numpy(dtype=float)
+        filled = closes.ffill().to_numpy(dtype=float)
+        monthly_returns = np.full_like(prices, np.nan)
+        monthly_returns[1:] = np.diff(filled, axis=0) / filled[:-1]
+        monthly_returns[np.isnan(prices)] = np.nan
+        return pd.DataFrame(monthly_returns, index=closes.index, columns=closes.columns)
+
+    def calculate_avg_return(self, monthly_returns: pd.DataFrame) -> pd.Series:
+        """Calculates the average annual return of every symbol from its monthly returns."""
+        returns = monthly_returns.to_numpy()
+        counts = np.count_nonzero(~np.isnan(returns), axis=0)
+        average_monthly_return = np.full(returns.shape[1], np.nan)
+        has_returns = counts > 0
+        average_monthly_return[has_returns] = np.nansum(returns[:, has_returns], axis=0) / counts[has_returns]
+        average_annual_return = (1 + average_monthly_return) ** 12 - 1
+        return pd.Series(average_annual_return, index=monthly_returns.columns)
+
     async def get_investment_options(self, sectors_of_interest: str, period: int) -> list:
         sectors_of_interest_list = sectors_of_interest.split(",")
-        symbols_and_industries_json = self.sp500(sectors_of_interest_list)
-        symbols_and_industries = json.loads(symbols_and_industries_json)["symbols_and_industries"]
+        symbols_and_industries = await self._sp500_raw(sectors_of_interest_list)
+        symbols = [item["symbol"] for item in symbols_and_industries]
+        data = await asyncio.to_thread(self.get_historical_data, symbols, period)
+        if data.empty:
+            return []
+        closes = data.xs('Close', axis=1, level=1).dropna(axis=1, how='all')
+        monthly_returns = self.calculate_returns(closes)
+        average_returns = self.calculate_avg_return(monthly_returns)
         options = []
         for item in symbols_and_industries:
             symbol = item["symbol"]
             industry = item["industry"]
+            if symbol not in closes.columns:
+                print(f"No data returned for {symbol}")
+                continue
             try:
-                df = await self.get_historical_data(symbol, period)
+                df = pd.DataFrame({'Close': closes[symbol], 'monthly_return': monthly_returns[symbol]}).dropna(subset=['Close'])
                 if not df.empty:
-                    df = self.calculate_returns(df)
-                    average_return = self.calculate_avg_return(df)
+                    average_return = average_returns[symbol]
 
                     df.reset_index(inplace=True) 
+                    dates = df['Date'].dt.strftime('%Y-%m-%d').to_numpy()
                     options.append({
                         "symbol": symbol,
                         "average_return": average_return,
                         "industry": industry,
-                        "stock_prices": {row['Date'].strftime('%Y-%m-%d'): row['Close'] for index, row in df.iterrows()},
-                        "monthly_return": {row['Date'].strftime('%Y-%m-%d'): row['monthly_return'] for index, row in df.iterrows()}
+                        "stock_prices": dict(zip(dates, df['Close'].to_numpy().tolist())),
+                        "monthly_return": dict(zip(dates, df['monthly_return'].to_numpy().tolist()))
                     })
             except Exception as e:
                 print(f"Error processing {symbol}: {e}")
@@ -4,6 +4,8 @@ MarketingAgent module for generating and storing marketing content
 This module provides functionality to generate marketing content using an AI agent
 and store the results in a MongoDB database. It includes methods for calling the
 marketing agent API, writing data to MongoDB, and handling authentication.
+`run_many` does the same for several personas at once, writing every response
+in a single batched insert.
 
 Input required:
 - persona: str (marketing persona description)
@@ -15,26 +17,43 @@ Expected output:
 - str: 'Success' if the operation completes successfully, otherwise raises an exception
 """
 from dagger import function, object_type, Secret
-import requests
+import httpx
 import pymongo
-from pymongo.errors import AutoReconnect, OperationFailure
-import json
+from pymongo.errors import OperationFailure
+import asyncio
+import functools
 from datetime import datetime
-from urllib.parse import quote_plus
+from urllib.parse import quote_plus, urlsplit, urlunsplit
+
+AGENT_TIMEOUT = httpx.Timeout(120, connect=5)
+
+http_client = httpx.AsyncClient(timeout=AGENT_TIMEOUT, transport=httpx.AsyncHTTPTransport(retries=3, limits=httpx.Limits(max_connections=20)))
+
+@functools.lru_cache(maxsize=4)
+def _get_client(connection_string: str) -> pymongo.MongoClient:
+    return pymongo.MongoClient(connection_string, maxPoolSize=50, retryWrites=True, retryReads=True, serverSelectionTimeoutMS=10000, connectTimeoutMS=5000)
 
 @object_type
 class MarketingAgent:
     @function
     async def run(self, persona: str, business_name: str, connection: Secret, database: str) -> str:
         """Calls marketing agent and writes the response to MongoDB"""
-        marketing_data = self.call_marketing_agent(persona, business_name)        
+        marketing_data = await self.call_marketing_agent(persona, business_name)        
         if "error" in marketing_data:
             raise RuntimeError(f"Error from marketing agent: {marketing_data['error']}")
-        marketing_data_json = json.dumps(marketing_data)
-        write_result = await self.write(marketing_data_json, connection, database, business_name)
+        write_result = await self.write(marketing_data, connection, database, business_name)
         return write_result
+
+    @function
+    async def run_many(self, personas: list[str], business_name: str, connection: Secret, database: str) -> str:
+        """Calls marketing agent for several personas concurrently and writes all responses to MongoDB in one batch"""
+        responses = await asyncio.gather(*(self.call_marketing_agent(persona, business_name) for persona in personas))
+        errors = [response['error'] for response in responses if "error" in response]
+        if errors:
+            raise RuntimeError(f"Error from marketing agent: {errors}")
+        return await self.write_many(responses, connection, database, business_name)
     
-    def call_marketing_agent(self, persona: str, business_name: str):
+    async def call_marketing_agent(self, persona: str, business_name: str):
         url = "https://emms21--marketing-agent-agent.modal.run"
         headers = {
             "Content-Type": "application/json"
@@ -44,7 +63,14 @@ class MarketingAgent:
             "business_name": business_name
         }
         
-        response = requests.post(url, headers=headers, json=data)
+        try:
+            response = await http_client.post(url, headers=headers, json=data)
+        except httpx.HTTPError as e:
+            return {
+                "error": f"Failed to call the endpoint: {e!r}",
+                "status_code": None,
+                "response": ""
+            }
         
         if response.status_code == 200:
             return response.json()
@@ -55,48 +81,42 @@ class MarketingAgent:
                 "response": response.text
             }
                 
-    async def write(self, data: str, connection: Secret, database: str, company_name: str) -> str:
+    async def write(self, data: dict, connection: Secret, database: str, company_name: str) -> str:
         """Writes processed data into MongoDB under a collection named after the company."""
+        return await self.write_many([data], connection, database, company_name)
+
+    async def write_many(self, documents: list[dict], connection: Secret, database: str, company_name: str) -> str:
+        """Writes a batch of documents into MongoDB in a single unordered insert_many."""
+        if not documents:
+            return 'Success'
         connection_string = await connection.plaintext()
         collection = self.authenticate(connection_string, database, company_name)
-        parsed_data = json.loads(data)       
         current_date = datetime.now()
-        parsed_data['date_written'] = {
+        date_written = {
             'year': current_date.year,
             'month': current_date.month,
             'day': current_date.day
         }
-                
+        for document in documents:
+            document['date_written'] = date_written
+
         try:
-            collection.insert_one(parsed_data)
+            collection.insert_many(documents, ordered=False)
         except (RuntimeError, OperationFailure) as e:
             raise RuntimeError("Failed to write to MongoDB") from e         
         return 'Success'
 
     def authenticate(self, connection_string: str, database: str, collection_name: str):
-            """Authenticates with MongoDB and returns a reference to the collection."""
-            max_retries = 3
-            retries = 0
-            while retries < max_retries:
-                try:
-                    client = pymongo.MongoClient(connection_string)
-                    db = client[database]
-                    return db[collection_name]
-                except AutoReconnect as e:
-                    retries += 1
-                    if retries == max_retries:
-                        raise OperationFailure(f"Failed to connect to MongoDB after {max_retries} retries: {e}")
-                except OperationFailure as e:
-                    raise OperationFailure(f"Failed to authenticate with MongoDB: {e}")
+        """Returns a reference to the collection on a client shared across calls, leaving retries to the driver."""
+        return _get_client(connection_string)[database][collection_name]
                 
     def encode_credentials(self, connection_string: str) -> str:
         """Encodes the username and password in the connection string."""
-        parts = connection_string.split('@')
-        creds, host = parts[0], parts[1]
-        username, password = creds.split('//')[1].split(':')
-        encoded_username = quote_plus(username)
-        encoded_password = quote_plus(password)
-        return f"mongodb+srv://{encoded_username}:{encoded_password}@{host}"
+        parts = urlsplit(connection_string)
+        creds, _, host = parts.netloc.rpartition('@')
+        username, _, password = creds.partition(':')
+        netloc = f"{quote_plus(username)}:{quote_plus(password)}@{host}"
+        return urlunsplit(parts._replace(netloc=netloc))
 
 # # Example usage
 # result = call_marketing_agent("Finance bros turning Software Engineer", "fractaltech")
@@ -17,30 +17,49 @@ modal_entry_point: web entry point to AI Agent deployed in Modal
 Returns:
 - Success if data is successfully written to MongoDB
 
+`run_many` takes a list of personas and writes every research result in a single batched insert.
+
 """
 import pymongo
-import requests
-import json
+import httpx
 from datetime import datetime
-from urllib.parse import quote_plus
-from pymongo.errors import AutoReconnect, OperationFailure
+from urllib.parse import quote_plus, urlsplit, urlunsplit
+from pymongo.errors import OperationFailure
 from dagger import function, object_type, Secret
+import functools
+import asyncio
+
+AGENT_TIMEOUT = httpx.Timeout(120, connect=5)
+
+http_client = httpx.AsyncClient(timeout=AGENT_TIMEOUT, transport=httpx.AsyncHTTPTransport(retries=3, limits=httpx.Limits(max_connections=20)))
+
+@functools.lru_cache(maxsize=4)
+def _get_client(connection_string: str) -> pymongo.MongoClient:
+    return pymongo.MongoClient(connection_string, maxPoolSize=50, retryWrites=True, retryReads=True, serverSelectionTimeoutMS=5000)
 
 @object_type
 class ResearcherContainer:
     @function
-    def run(self, business_name: str, personas: str, connection: Secret, modal_entry_point: Secret) -> str:
+    async def run(self, business_name: str, personas: str, connection: Secret, modal_entry_point: Secret) -> str:
         """Calls marketing agent with business and persona data, then writes results to MongoDB."""
-        try: 
-            research_output = self.call_marketing_agent(personas, business_name, modal_entry_point)
-            research_json = json.dumps(research_output)
-        except RuntimeError as e:
-            raise RuntimeError(f"Error from marketing agent: {research_json['error']}, error:{e}")
-        return self.write(research_json, connection, "marketing_agent", business_name)
+        modal_url = await modal_entry_point.plaintext()
+        research_output = await self.call_marketing_agent(personas, business_name, modal_url)
+        if "error" in research_output:
+            raise RuntimeError(f"Error from marketing agent: {research_output['error']}, status code: {research_output['status_code']}")
+        return await self.write_many([research_output], connection, "marketing_agent", business_name)
 
-    async def call_marketing_agent(self, persona: str, business_name: str, modal_entry_point: Secret):
-        """Sends a POST request to the marketing agent API with persona and business data."""
+    @function
+    async def run_many(self, business_name: str, personas: list[str], connection: Secret, modal_entry_point: Secret) -> str:
+        """Researches several personas for a business, then writes all results to MongoDB in one batch."""
         modal_url = await modal_entry_point.plaintext()
+        research_outputs = await asyncio.gather(*(self.call_marketing_agent(persona, business_name, modal_url) for persona in personas))
+        errors = [output['error'] for output in research_outputs if "error" in output]
+        if errors:
+            raise RuntimeError(f"Error from marketing agent: {errors}")
+        return await self.write_many(research_outputs, connection, "marketing_agent", business_name)
+
+    async def call_marketing_agent(self, persona: str, business_name: str, modal_url: str):
+        """Sends a POST request to the marketing agent API with persona and business data."""
         headers = {
             "Content-Type": "application/json"
         }
@@ -49,7 +68,14 @@ class ResearcherContainer:
             "business_name": business_name
         }
         
-        response = requests.post(modal_url, headers=headers, json=data)
+        try:
+            response = await http_client.post(modal_url, headers=headers, json=data)
+        except httpx.HTTPError as e:
+            return {
+                "error": f"Failed to call the endpoint: {e!r}",
+                "status_code": None,
+                "response": ""
+            }
         if response.status_code == 200:
             return response.json()
         else:
@@ -59,45 +85,35 @@ class ResearcherContainer:
                 "response": response.text
             }
     
-    async def write(self, data: str, connection: Secret, database: str, business_name: str) -> str:
-        """Writes processed data into MongoDB under a collection named after the company."""
+    async def write_many(self, documents: list[dict], connection: Secret, database: str, business_name: str) -> str:
+        """Writes a batch of research documents into MongoDB in a single unordered insert_many."""
+        if not documents:
+            return 'Success'
         connection_string = await connection.plaintext()
         collection = self.authenticate(connection_string, database, business_name)
-        parsed_data = json.loads(data)       
         current_date = datetime.now()
-        parsed_data['date_written'] = {
+        date_written = {
             'year': current_date.year,
             'month': current_date.month,
             'day': current_date.day
         }
-                
+        for document in documents:
+            document['date_written'] = date_written
+
         try:
-            collection.insert_one(parsed_data)
+            collection.insert_many(documents, ordered=False)
         except (RuntimeError, OperationFailure) as e:
             raise RuntimeError("Failed to write to MongoDB") from e         
         return 'Success'
 
     def authenticate(self, connection_string: str, database: str, collection_name: str):
-            """Authenticates with MongoDB and returns a reference to the collection."""
-            max_retries = 3
-            retries = 0
-            while retries < max_retries:
-                try:
-                    client = pymongo.MongoClient(connection_string)
-                    db = client[database]
-                    return db[collection_name]
-                except AutoReconnect as e:
-                    retries += 1
-                    if retries == max_retries:
-                        raise OperationFailure(f"Failed to connect to MongoDB after {max_retries} retries: {e}")
-                except OperationFailure as e:
-                    raise OperationFailure(f"Failed to authenticate with MongoDB: {e}")
+            """Returns a reference to the collection on a client shared across calls."""
+            return _get_client(connection_string)[database][collection_name]
                 
     def encode_credentials(self, connection_string: str) -> str:
         """Encodes the username and password in the connection string."""
-        parts = connection_string.split('@')
-        creds, host = parts[0], parts[1]
-        username, password = creds.split('//')[1].split(':')
-        encoded_username = quote_plus(username)
-        encoded_password = quote_plus(password)
-        return f"mongodb+srv://{encoded_username}:{encoded_password}@{host}"
\ No newline at end of file
+        parts = urlsplit(connection_string)
+        creds, _, host = parts.netloc.rpartition('@')
+        username, _, password = creds.partition(':')
+        netloc = f"{quote_plus(username)}:{quote_plus(password)}@{host}"
+        return urlunsplit(parts._replace(netloc=netloc))
\ No newline at end of file
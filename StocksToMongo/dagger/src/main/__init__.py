@@ -24,9 +24,14 @@ dagger call getStocks --connection=[Secret] --db=[str] --collection=<str> --sect
 import dagger
 from dagger import dag, function, object_type, Secret
 import pymongo
-from pymongo.errors import AutoReconnect, OperationFailure
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 import json
-from datetime import datetime
+import functools
+
+@functools.lru_cache(maxsize=4)
+def _get_client(connection_string: str) -> pymongo.MongoClient:
+    return pymongo.MongoClient(connection_string, maxPoolSize=50, retryWrites=True, retryReads=True, serverSelectionTimeoutMS=5000)
 
 @object_type
 class StocksToMongo:
@@ -41,43 +46,28 @@ class StocksToMongo:
         stocks_collection = self.authenticate(connection_string, db, collection)
         parsed_data = json.loads(stocks_data)
         investments = parsed_data.get("investments", [])
-        stock_data_last_update = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-        try:
-            for stock in investments:
-                symbol = stock.get('symbol')
-                if not symbol:
-                    print("Skipping stock without symbol")
-                    continue
 
-                update_document = {
-                    "$set": {**stock, "stock_data_last_update": stock_data_last_update}
-                }
+        operations = [
+            UpdateOne(
+                {'symbol': stock['symbol']},
+                {"$set": stock, "$currentDate": {"stock_data_last_update": True}},
+                upsert=True
+            )
+            for stock in investments if stock.get('symbol')
+        ]
+        skipped = len(investments) - len(operations)
+        if skipped:
+            print(f"Skipping {skipped} stocks without symbol")
 
-                stocks_collection.update_one(
-                    filter={'symbol': symbol},
-                    update=update_document,
-                    upsert=True
-                )
+        try:
+            if operations:
+                stocks_collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            raise RuntimeError(f"Failed to write to MongoDB: {e.details.get('writeErrors')}") from e
         except RuntimeError as e:
             raise RuntimeError("Failed to write to MongoDB") from e
         return 'Success'
 
     def authenticate(self, connection_string: str, db: str, collection: str):
-        """Authenticates with MongoDB and returns a reference to the stocks collection."""
-        max_retries = 3
-        retries = 0
-        while retries < max_retries:
-            try:
-                client = pymongo.MongoClient(connection_string)
-                db = client[db]
-                return db[collection]
-            except AutoReconnect as e:
-                retries += 1
-                if retries == max_retries:
-                    raise OperationFailure(f"Failed to connect to MongoDB after {max_retries} retries: {e}")
-            except OperationFailure as e:
-                raise OperationFailure(f"Failed to authenticate with MongoDB: {e}")
-
-
-
+        """Returns a reference to the stocks collection on a client shared across calls."""
+        return _get_client(connection_string)[db][collection]
@@ -19,9 +19,11 @@ Categories used for classification include:
 This module includes functions to handle the retrieval and processing of transaction data, employing robust error handling and retry logic to manage API limits and ensure reliable operation.
 
 Functions:
-- `process_batch`: Processes a batch of transactions by submitting descriptions to the Hugging Face model and categorizing them based on the model's predictions. This function handles API responses and segregates processed transactions from those that couldn't be categorized due to errors or API limits.
+- `process_batch`: Processes a batch of transactions by submitting each distinct description once to the Hugging Face model, reusing categories already assigned earlier in the run, and categorizing them based on the model's predictions. This function handles API responses and segregates processed transactions from those that couldn't be categorized due to errors or API limits.
 
-- `categorize`: The main function of the module, orchestrating the retrieval of transaction data, invoking the `process_batch` function, and managing retries in case of failures. It ensures that all transactions are processed, leveraging asynchronous programming to handle potentially large volumes of data efficiently.
+- `categorize`: The main function of the module, orchestrating the retrieval of transaction data, invoking the `process_batch` function, and managing retries in case of failures. Each transaction is retried up to `MAX_ATTEMPTS_PER_TRANSACTION` times; any that still fail are reported and returned without a 'Category' field so callers can spot and retry them, leveraging asynchronous programming to handle potentially large volumes of data efficiently.
+
+- `batch_worker`: Pulls batches from the retry queue and the incoming transaction stream and runs them through `process_batch`. `categorize` runs several workers at once so batches overlap, bounded by `MAX_CONCURRENT_BATCHES`.
 
 - `adjust_batch_size`: Adjusts the batch size dynamically based on response times and API rate limits to optimize throughput.
 
@@ -43,32 +45,72 @@ Usage of this module can significantly streamline the process of categorizing fi
 """
 
 
-from dagger import dag, function, object_type, Secret
-import json
+from dagger import function, object_type, Secret
+import orjson
+import ijson
+import io
 import asyncio
 import time 
+import random
+import httpx
+from itertools import islice
+from collections import deque
+
+HF_URL = 'https://api-inference.huggingface.co/models/facebook/bart-large-mnli'
+INITIAL_BATCH_SIZE = 50
+MAX_CONCURRENT_BATCHES = 4
+MAX_RETRY_DELAY = 60
+MAX_ATTEMPTS_PER_TRANSACTION = 5
+HF_TIMEOUT = httpx.Timeout(60, connect=5)
+HF_MAX_RETRIES = 3
+CATEGORIES = ["Grocery", "Snacks", "Takeouts", "Entertainment", "Transportation", "Credit Card Payment", "Shopping", "Personal Care", "Healthcare"]
+HF_PARAMETERS = {"candidate_labels": CATEGORIES, "multi_label": False}
+
+http_client = httpx.AsyncClient(timeout=HF_TIMEOUT, transport=httpx.AsyncHTTPTransport(retries=HF_MAX_RETRIES, limits=httpx.Limits(max_connections=32)))
 
 @object_type
 class CategorizeExpenses:
-    initial_batch_size = 50  
-    current_batch_size = initial_batch_size
-    api_call_times = []
-    response_times = []
-
     @function
     async def categorize(self, data: str, hftoken: Secret) -> str:
         """Processes transactions using an AI model from Hugging Face with retry logic for API limits."""
-        retry_delay = 5  
+        hf_api_key = await hftoken.plaintext()
+        self.current_batch_size = INITIAL_BATCH_SIZE
+        self.api_call_times = deque()
+        self.response_times = deque(maxlen=5)
+        self.category_cache = {}
+        self.retry_not_before = 0.0
         processed = []
-        unprocessed = json.loads(data)
-
-        while unprocessed:
+        unprocessed = deque()
+        dead_letters = []
+        pending = ijson.items(io.BytesIO(data.encode()), 'item', use_float=True)
+
+        try:
+            await asyncio.gather(*(self.batch_worker(pending, unprocessed, processed, dead_letters, hf_api_key) for _ in range(MAX_CONCURRENT_BATCHES)))
+        except ijson.JSONError as e:
+            raise ValueError(f"Transaction data is not a valid JSON array, stopped after categorizing {len(processed)} transactions: {e}") from e
+
+        if dead_letters:
+            print(f"Gave up on {len(dead_letters)} transactions after {MAX_ATTEMPTS_PER_TRANSACTION} attempts each, returning them uncategorized: {[transaction.get('Description', '') for transaction in dead_letters]}")
+            processed.extend(dead_letters)
+
+        return orjson.dumps(processed, option=orjson.OPT_INDENT_2).decode()  
+
+    async def batch_worker(self, pending, unprocessed, processed, dead_letters, hf_api_key):
+        """Takes batches from the retry queue and the pending stream until both are exhausted, so at most MAX_CONCURRENT_BATCHES are in flight, giving up on a transaction after MAX_ATTEMPTS_PER_TRANSACTION tries. A failed batch pushes back retry_not_before, which every worker waits out before taking its next batch."""
+        failed_attempts = 0
+        while True:
+            while (wait := self.retry_not_before - time.monotonic()) > 0:
+                await asyncio.sleep(wait)
             batch_size = self.adjust_batch_size()
-            batch = unprocessed[:batch_size]
-            unprocessed = unprocessed[batch_size:]
+            queued = [unprocessed.popleft() for _ in range(min(batch_size, len(unprocessed)))]
+            queued.extend((transaction, 0) for transaction in islice(pending, batch_size - len(queued)))
+            if not queued:
+                return
+            batch = [transaction for transaction, _ in queued]
+            attempts = {id(transaction): attempt + 1 for transaction, attempt in queued}
 
             start_time = time.time()
-            batch_processed, batch_unprocessed = await self.process_batch(batch, hftoken)
+            batch_processed, batch_unprocessed, retry_after = await self.process_batch(batch, hf_api_key)
             end_time = time.time()
 
             self.api_call_times.append(end_time)
@@ -76,67 +118,92 @@ class CategorizeExpenses:
             self.cleanup_api_call_times()
  
             processed.extend(batch_processed)
-            unprocessed = batch_unprocessed + unprocessed
-
-            if unprocessed:
-                print(f"API limit reached or error occurred. {len(unprocessed)} entries remain unprocessed. Retrying after {retry_delay} seconds...")
-                await asyncio.sleep(retry_delay)  
-
-        return json.dumps(processed, indent=4)  
+            retries = []
+            for transaction in batch_unprocessed:
+                if attempts[id(transaction)] >= MAX_ATTEMPTS_PER_TRANSACTION:
+                    dead_letters.append(transaction)
+                else:
+                    retries.append((transaction, attempts[id(transaction)]))
+            unprocessed.extendleft(reversed(retries))
+
+            if batch_unprocessed:
+                retry_delay = self.get_retry_delay(failed_attempts, retry_after)
+                failed_attempts += 1
+                self.retry_not_before = max(self.retry_not_before, time.monotonic() + retry_delay)
+                print(f"API limit reached or error occurred. {len(unprocessed)} entries remain unprocessed. Retrying after {retry_delay:.1f} seconds...")
+            else:
+                failed_attempts = 0
+
+    def get_retry_delay(self, failed_attempts, retry_after):
+        """Returns how long to wait before retrying, preferring the server's own estimate over jittered exponential backoff. Only the backoff is capped at MAX_RETRY_DELAY; the server's estimate is honoured in full."""
+        if retry_after is not None:
+            return retry_after + random.uniform(0.05, 0.25)
+        return min(MAX_RETRY_DELAY, random.uniform(2, 4) * 2 ** failed_attempts)
     
     def adjust_batch_size(self):
         """Adjust the batch size based on the response times and API rate limits."""
         if len(self.api_call_times) > 1 and (self.api_call_times[-1] - self.api_call_times[0] < 60):
             self.current_batch_size = max(1, self.current_batch_size - 1)
-        elif self.response_times and len(self.response_times) >= 5 and sum(self.response_times[-5:]) / 5 < 1:
+        elif len(self.response_times) == self.response_times.maxlen and sum(self.response_times) / self.response_times.maxlen < 1:
             self.current_batch_size += 1
 
         return self.current_batch_size
     
     def cleanup_api_call_times(self):
         """Clean up the API call times to keep track within the last minute."""
-        current_time = time.time()
-        self.api_call_times = [call_time for call_time in self.api_call_times if current_time - call_time < 60]
-
-    async def process_batch(self, transactions, hftoken):
-        """Processes a batch of transactions and categorizes them."""
-        process_script = """
-import sys
-import json
-import requests
-import os
-
-hf_api_key = os.environ.get('HUGGING_FACE')
-hf_url = 'https://api-inference.huggingface.co/models/facebook/bart-large-mnli'
-categories = ["Grocery", "Snacks", "Takeouts", "Entertainment", "Transportation", "Credit Card Payment", "Shopping", "Personal Care", "Healthcare"]
-
-transactions = json.loads(sys.argv[1])
-processed = []
-unprocessed = []
-
-for transaction in transactions:
-    description = transaction.get('Description', '')
-    payload = {"inputs": description, "parameters": {"candidate_labels": categories}}
-    response = requests.post(hf_url, headers={"Authorization": f"Bearer {hf_api_key}"}, json=payload)
-    if response.ok:
-        data = response.json()
-        if 'labels' in data and 'scores' in data:
-            transaction['Category'] = data['labels'][0]
-            processed.append(transaction)
-        else:
-            unprocessed.append(transaction)
-    else:
-        unprocessed.append(transaction)
-
-print(json.dumps({'processed': processed, 'unprocessed': unprocessed}))
-"""
-        container = (
-            dag.container()
-            .from_("python:3.9-slim")
-            .with_exec(["pip", "install", "requests"])
-            .with_secret_variable("HUGGING_FACE", hftoken)
-            .with_exec(["python", "-c", process_script, json.dumps(transactions)])
-        )
-        output = await container.stdout()
-        results = json.loads(output)
-        return results['processed'], results['unprocessed']
+        cutoff = time.time() - 60
+        while self.api_call_times and self.api_call_times[0] <= cutoff:
+            self.api_call_times.popleft()
+
+    async def process_batch(self, transactions, hf_api_key):
+        """Categorizes a batch of transactions, sending each description not already in the category cache once in a single multi-input request."""
+        processed = []
+        to_classify = {}
+        for transaction in transactions:
+            key = transaction.get('Description', '').strip().lower()
+            if key in self.category_cache:
+                transaction['Category'] = self.category_cache[key]
+                processed.append(transaction)
+            else:
+                to_classify.setdefault(key, []).append(transaction)
+        if not to_classify:
+            return processed, [], None
+
+        waiting = [transaction for group in to_classify.values() for transaction in group]
+        payload = {"inputs": [group[0].get('Description', '') for group in to_classify.values()], "parameters": HF_PARAMETERS}
+        try:
+            response = await http_client.post(HF_URL, headers={"Authorization": f"Bearer {hf_api_key}"}, json=payload)
+        except httpx.HTTPError:
+            return processed, waiting, None
+        if not response.is_success:
+            return processed, waiting, self.get_retry_after(response)
+        results = response.json()
+        if isinstance(results, dict):
+            results = [results]
+        if not isinstance(results, list) or len(results) != len(to_classify):
+            return processed, waiting, None
+
+        unprocessed = []
+        for (key, group), result in zip(to_classify.items(), results):
+            if 'labels' in result and 'scores' in result:
+                self.category_cache[key] = result['labels'][0]
+                for transaction in group:
+                    transaction['Category'] = result['labels'][0]
+                processed.extend(group)
+            else:
+                unprocessed.extend(group)
+        return processed, unprocessed, None
+
+    def get_retry_after(self, response):
+        """Reads the server's wait hint: Retry-After on 429, or the model's estimated_time while it loads on 503."""
+        if response.status_code == 429 and 'Retry-After' in response.headers:
+            try:
+                return float(response.headers['Retry-After'])
+            except ValueError:
+                return None
+        if response.status_code == 503:
+            try:
+                return float(response.json()['estimated_time'])
+            except (ValueError, KeyError, TypeError):
+                return None
+        return None
@@ -13,59 +13,58 @@ Args:
 - `apiKey (Secret)`: The API key required to authenticate requests to the Google Sheets API. It should have the necessary permissions to access the spreadsheet.
 - `sheet (Secret)`: The ID of the Google Spreadsheet. This ID is typically found in the URL of the spreadsheet when opened in a web browser.
 - `name (str)`: The name of the specific sheet within the Google Spreadsheet from which to fetch data.
+- `names (list[str])`: For `fetch_ranges`, the sheets to fetch in a single batched request.
 
 Return:
 - The function returns a JSON formatted string. If transaction data is present, it returns a JSON string representing an array of transactions, where each transaction is a dictionary with column headers as keys. If no data is found, it returns an empty array '[]' in JSON format.
 
 Example Call:
 dagger call fetch-data --apiKey=env:[KEY] --sheet=env:[KEY] --name='Sheet1'
+dagger call fetch-ranges --apiKey=env:[KEY] --sheet=env:[KEY] --names='Sheet1,Sheet2'
 """
 
-from dagger import dag, function, object_type, Secret
+from dagger import function, object_type, Secret
+import asyncio
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+SHEETS_TIMEOUT = (5, 30)
+SHEETS_MAX_RETRIES = 5
+HEADERS = {'Accept-Encoding': 'gzip', 'User-Agent': 'fetch-spreadsheet-data (gzip)'}
+
+session = requests.Session()
+session.mount('https://', HTTPAdapter(max_retries=Retry(total=SHEETS_MAX_RETRIES, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), respect_retry_after_header=True)))
 
 @object_type
 class FetchSpreadsheetData:
     @function
     async def fetch_data(self, apiKey: Secret, sheet: Secret, name: str) -> str:
         """Fetches transaction data from a Google Spreadsheet."""
-        fetch_script = """
-import requests
-import json
-import os
+        transactions_by_range = await self.get_value_ranges(apiKey, sheet, [name])
+        return orjson.dumps(transactions_by_range[0]).decode()
 
-api_key = os.environ.get('API_KEY')
-spreadsheet_id = os.environ.get('SPREADSHEET_ID')
-sheet_name = os.environ.get('SHEET_NAME')
-url = f'https://sheets.googleapis.com/v4/spreadsheets/{spreadsheet_id}/values/{sheet_name}?key={api_key}'
-response = requests.get(url)
-data = response.json()
-
-print(json.dumps(data))
-"""
-        process_script = """
-import sys
-import json
+    @function
+    async def fetch_ranges(self, apiKey: Secret, sheet: Secret, names: list[str]) -> str:
+        """Fetches transaction data from several sheets of a Google Spreadsheet, keyed by sheet name."""
+        transactions_by_range = await self.get_value_ranges(apiKey, sheet, names)
+        return orjson.dumps(dict(zip(names, transactions_by_range))).decode()
 
-data = json.loads(sys.argv[1])
+    async def get_value_ranges(self, apiKey: Secret, sheet: Secret, names: list[str]) -> list[list[dict]]:
+        """Fetches every requested sheet in one values:batchGet request and converts each to a list of transactions."""
+        api_key, spreadsheet_id = await asyncio.gather(apiKey.plaintext(), sheet.plaintext())
+        url = f'https://sheets.googleapis.com/v4/spreadsheets/{spreadsheet_id}/values:batchGet'
+        params = {'ranges': names, 'key': api_key}
+        response = await asyncio.to_thread(session.get, url, params=params, headers=HEADERS, timeout=SHEETS_TIMEOUT)
+        data = response.json()
+        value_ranges = data.get('valueRanges', [{} for _ in names])
+        return [self.to_transactions(value_range) for value_range in value_ranges]
 
-if 'values' in data:
-    headers = data['values'][0]
-    rows = data['values'][1:]
-    transactions = [dict(zip(headers, row)) for row in rows]
-    print(json.dumps(transactions))
-else:
-    print('[]')
-"""
-        container = (
-            dag.container()
-            .from_("python:3.9-slim")
-            .with_exec(["pip", "install", "requests"])
-            .with_secret_variable("API_KEY", apiKey)
-            .with_secret_variable("SPREADSHEET_ID", sheet)
-            .with_env_variable("SHEET_NAME", name)
-            .with_exec(["python", "-c", fetch_script])
-        )
-        raw_data = await container.stdout()
-        container = container.with_exec(["python", "-c", process_script, raw_data])
-        output = await container.stdout()
-        return output
\ No newline at end of file
+    def to_transactions(self, value_range: dict) -> list[dict]:
+        """Converts a sheet's rows into dictionaries keyed by the header row."""
+        if 'values' not in value_range:
+            return []
+        headers = value_range['values'][0]
+        rows = value_range['values'][1:]
+        return [dict(zip(headers, row)) for row in rows]
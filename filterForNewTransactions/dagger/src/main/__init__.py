@@ -6,7 +6,7 @@ This module is specifically designed to interface with MongoDB to filter new tra
 The module provides functions to authenticate to MongoDB and to filter new transactions based on their unique identifiers. These functions can be called via the dagger CLI or programmatically through one of the supported SDKs.
 
 Functions:
-- `authenticate`: This utility function establishes a connection to a specified MongoDB collection using provided credentials and returns a reference to the collection. It is not directly callable via the CLI but is used internally by other functions.
+- `authenticate`: This utility function returns a reference to a specified MongoDB collection on a client that is created once per connection string and reused across calls. The first connection is confirmed with a ping, retried with jittered exponential backoff if the deployment is unreachable; `filter` runs it in a worker thread so the waits do not block the event loop. It is not directly callable via the CLI but is used internally by other functions.
 - `filter`: This is the primary function of the module. It accepts transaction data as a JSON string along with MongoDB connection details, and filters out transactions that are already present in the database.
 
 Args:
@@ -23,34 +23,47 @@ Example Call:
 """
 
 from dagger import dag, function, object_type, Secret
-import json
+import orjson
+import asyncio
 import pymongo
 from pymongo.errors import AutoReconnect, OperationFailure
+import functools
+import random
+import time
+
+MAX_CONNECT_ATTEMPTS = 3
+MAX_CONNECT_DELAY = 30
+
+@functools.lru_cache(maxsize=4)
+def _get_client(connection_string: str) -> pymongo.MongoClient:
+    """Creates the client for a connection string and waits for the deployment to answer, backing off between attempts."""
+    client = pymongo.MongoClient(connection_string, maxPoolSize=50, retryWrites=True, retryReads=True, serverSelectionTimeoutMS=5000, compressors="zstd,zlib")
+    for attempt in range(MAX_CONNECT_ATTEMPTS):
+        try:
+            client.admin.command('ping')
+            return client
+        except AutoReconnect as e:
+            if attempt == MAX_CONNECT_ATTEMPTS - 1:
+                client.close()
+                raise OperationFailure(f"Failed to connect to MongoDB after {MAX_CONNECT_ATTEMPTS} retries: {e}")
+            time.sleep(min(MAX_CONNECT_DELAY, random.uniform(0.5, 1.5) * 2 ** attempt))
+        except OperationFailure as e:
+            client.close()
+            raise OperationFailure(f"Failed to authenticate with MongoDB: {e}")
 
 @object_type
 class FilterForNewTransactions:
     @function
     async def filter(self, data: str, connection: Secret, database: str, collection: str) -> str:
         """Filters out transactions that are already in the database."""
-        transactions = json.loads(data)
+        transactions = orjson.loads(data)
         connection_string = await connection.plaintext()
-        db = self.authenticate(connection_string, database, collection)
-        existing_ids = {item.get('Transaction ID') for item in db.find({}, {'Transaction ID': 1}) if 'Transaction ID' in item}
+        db = await asyncio.to_thread(self.authenticate, connection_string, database, collection)
+        incoming_ids = [trans['Transaction ID'] for trans in transactions if 'Transaction ID' in trans]
+        existing_ids = {item['Transaction ID'] for item in db.find({'Transaction ID': {'$in': incoming_ids}}, {'Transaction ID': 1, '_id': 0}).batch_size(1000)}
         filtered_transactions = [trans for trans in transactions if trans.get('Transaction ID') not in existing_ids]
-        return json.dumps(filtered_transactions)
+        return orjson.dumps(filtered_transactions).decode()
 
     def authenticate(self, connection_string: str, database: str, collection: str):
-        """Authenticates with MongoDB and returns a reference to the transactions collection."""
-        max_retries = 3
-        retries = 0
-        while retries < max_retries:
-            try:
-                client = pymongo.MongoClient(connection_string)
-                db = client[database]
-                return db[collection]
-            except AutoReconnect as e:
-                retries += 1
-                if retries == max_retries:
-                    raise OperationFailure(f"Failed to connect to MongoDB after {max_retries} retries: {e}")
-            except OperationFailure as e:
-                raise OperationFailure(f"Failed to authenticate with MongoDB: {e}")
+        """Returns a reference to the transactions collection on a client shared across calls."""
+        return _get_client(connection_string)[database][collection]
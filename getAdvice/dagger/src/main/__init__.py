@@ -22,7 +22,7 @@ dagger call generate --data='{"current_week": {"Groceries": "$150", "Utilities":
 
 
 Function - update_prompt:
-This function updates the initial prompt based on user feedback and regenerates advice using the updated prompt. It is triggered each time the user provides feedback on the AI-generated advice.
+This function updates the initial prompt based on user feedback and regenerates advice using the updated prompt. It is triggered each time the user provides feedback on the AI-generated advice. Repeating the same feedback for the same data within an hour returns the cached advice without calling the model again.
 
 Args:
 
@@ -40,6 +40,14 @@ dagger call update_prompt --feedback='I prefer more savings tips.' --data='{"cur
 
 This command processes the feedback and data, uses the updated prompt to generate new advice, and outputs refined recommendations based on the user’s input.
 
+
+Function - create_indexes:
+Creates the indexes behind the advice cache once per database: one on (type, key) for cache lookups, and a TTL index on ts that removes cached advice after RESPONSE_CACHE_TTL seconds. Run it once when setting up a database; generate and update_prompt do not create indexes themselves.
+
+Example Use Case:
+
+dagger call create_indexes --connection=env:DB_CONNECTION
+
 Technical Details
 Both functions interact with MongoDB to manage conversation states and ensure personalized advice that evolves over time. The generate function establishes an initial context, while update_prompt modifies this context based on user feedback, ensuring advice remains relevant and personalized.
 
@@ -47,14 +55,53 @@ The module aims to empower users with AI-driven insights for better financial di
 """
 
 from dagger import function, object_type, Secret
-import json
-from langchain.chains import ConversationChain
-from langchain_openai import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts.prompt import PromptTemplate
-import pymongo
-from pymongo.errors import AutoReconnect, OperationFailure
-from pymongo.collection import Collection
+import orjson
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
+import asyncio
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+import functools
+import hashlib
+import heapq
+from datetime import datetime, timedelta, timezone
+import math
+
+MEMORY_WINDOW_TURNS = 20
+MEMORY_SEARCH_ENTRIES = 200
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = 256
+RESPONSE_CACHE_TTL = 3600
+GENERATE_ADVISOR_PROMPT = "You are a financial advisor tasked with providing weekly spending insights, comparing these against historical data, advising on budget adherence for a $500 monthly limit on variable expenses, and considering shared expenses between Emmanuel and Jasmine. Generate advice that is highly personalized and summarized, focusing on cost-effective solutions and concise summaries. The advice should dynamically adapt based on their financial goals and the feedback that you have been given from your history. Keep your advice concise, highly personalized and actionable, ensuring it does not exceed 1000 characters."
+UPDATE_ADVISOR_PROMPT = "You are a financial advisor. Based on previous advice and user feedback, focus on incorporating the feedback given. Provide updated financial advice. Keep your advice concise, highly personalized and actionable, ensuring it does not exceed 1000 characters."
+
+@functools.lru_cache(maxsize=4)
+def _get_client(connection_string: str) -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(connection_string, maxPoolSize=10, retryWrites=True, retryReads=True, serverSelectionTimeoutMS=3000)
+
+def _build_prompt(advisor_prompt: str) -> ChatPromptTemplate:
+    """Puts the fixed advisor instructions first so every call shares the same prompt prefix, followed by the history and the new input."""
+    return ChatPromptTemplate.from_messages([
+        SystemMessage(content=advisor_prompt),
+        MessagesPlaceholder(variable_name="history"),
+        HumanMessagePromptTemplate.from_template("{input}")
+    ])
+
+GENERATE_PROMPT = _build_prompt(GENERATE_ADVISOR_PROMPT)
+UPDATE_PROMPT = _build_prompt(UPDATE_ADVISOR_PROMPT)
+
+@functools.lru_cache(maxsize=4)
+def _get_llm(openai_api_key: str) -> ChatOpenAI:
+    return ChatOpenAI(openai_api_key=openai_api_key, model_name="gpt-3.5-turbo", streaming=True)
+
+@functools.lru_cache(maxsize=4)
+def _get_embeddings(openai_api_key: str) -> OpenAIEmbeddings:
+    return OpenAIEmbeddings(openai_api_key=openai_api_key, model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS)
+
+def _cosine_similarity(a: list[float], b: list[float]) -> float:
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return sum(x * y for x, y in zip(a, b)) / norm if norm else 0.0
 
 @object_type
 class GetAdvice:
@@ -71,42 +118,35 @@ class GetAdvice:
         Returns:
             Dict[str, Union[str, bool]]: A dictionary containing the generated advice or an error message.
         """
-        transaction_data = json.loads(data)
-        current_week_key = next(iter(transaction_data))
-        previous_weeks_data = {k: v for k, v in transaction_data.items() if k != current_week_key}
-        openai_secret_key = await openai.plaintext()
-        connection_string = await connection.plaintext()
-        db = self.authenticate(connection_string, 'financials', 'memory')
-        openai = ChatOpenAI(openai_api_key=openai_secret_key, model_name="gpt-3.5-turbo")
-        
-        template = """
-        You are a financial advisor tasked with providing weekly spending insights, comparing these against historical data, advising on budget adherence for a $500 monthly limit on variable expenses, and considering shared expenses between Emmanuel and Jasmine. Generate advice that is highly personalized and summarized, focusing on cost-effective solutions and concise summaries. The advice should dynamically adapt based on their financial goals and the feedback that you have been given from your history. Keep your advice concise, highly personalized and actionable, ensuring it does not exceed 1000 characters.       
-        history: {history}
-        Human: {input} 
-        """
-        prompt_template = PromptTemplate(input_variables=["history", "input"], template=template)
+        transaction_data = orjson.loads(data)
+        current_week_data = transaction_data.pop(next(iter(transaction_data)))
+        previous_weeks_data = transaction_data
         context = {
-            "input": f"Here is this week's spending data: {transaction_data[current_week_key]}, and previous data: {previous_weeks_data}.",
+            "input": f"Here is this week's spending data: {current_week_data}, and previous data: {previous_weeks_data}.",
         }
+        openai_secret_key_task = asyncio.ensure_future(openai.plaintext())
+        connection_string = await connection.plaintext()
+        db = self.authenticate(connection_string, 'financials', 'memory')
+        memory_task = asyncio.ensure_future(self.get_memory_from_mongodb('JasEmm', db, MEMORY_SEARCH_ENTRIES))
+        openai_secret_key = await openai_secret_key_task
+        openai = _get_llm(openai_secret_key)
+        embeddings = _get_embeddings(openai_secret_key)
+        query_embedding, memory_data = await asyncio.gather(embeddings.aembed_query(context["input"]), memory_task)
+        context["history"] = self.build_history(memory_data, query_embedding)
 
-        memory_data = self.get_memory_from_mongodb('JasEmm', db)
-        memory = ConversationBufferMemory(memory_key="history", buffer=memory_data)
-        memory_variables = memory.load_memory_variables(inputs=context)
-        context["history"] = memory_variables.get("history", "")
-
-        conversation = ConversationChain(prompt=prompt_template, llm=openai, memory=memory)
-        response = conversation.predict(input=context["input"], history=context["history"])
-        memory.save_context(inputs={"input": context["input"]}, outputs={"history": response})
+        response = (await openai.ainvoke(GENERATE_PROMPT.format_messages(**context))).content
 
         new_memory_data = [
-            {"role": "human", "content": context["input"]},
-            {"role": "ai", "content": response}
+            {"role": "human", "content": context["input"], "embedding": query_embedding},
+            {"role": "ai", "content": response, "embedding": await embeddings.aembed_query(response)}
         ]
 
-        self.save_memory_to_mongodb('JasEmm', context["input"], "current_data", db)
-        self.save_memory_to_mongodb('JasEmm', new_memory_data, "conversational", db)
+        await db.bulk_write([
+            self.memory_operation('JasEmm', context["input"], "current_data"),
+            self.memory_operation('JasEmm', new_memory_data, "conversational")
+        ], ordered=False)
 
-        return json.dumps({'advice': response})
+        return orjson.dumps({'advice': response}).decode()
     
     @function
     async def update_prompt(self, feedback: str, data: str, openai: Secret, connection: Secret) -> str:
@@ -121,101 +161,120 @@ class GetAdvice:
         Returns:
             str: Updated financial advice.
         """
-        transaction_data = json.loads(data)
-        current_week_key = next(iter(transaction_data))
-        previous_weeks_data = {k: v for k, v in transaction_data.items() if k != current_week_key}
-        openai_secret_key = await openai.plaintext()
+        transaction_data = orjson.loads(data)
+        current_week_data = transaction_data.pop(next(iter(transaction_data)))
+        previous_weeks_data = transaction_data
+        openai_secret_key_task = asyncio.ensure_future(openai.plaintext())
         connection_string = await connection.plaintext()
         db = self.authenticate(connection_string, 'financials', 'memory')
-        openai = ChatOpenAI(openai_api_key=openai_secret_key, model_name="gpt-3.5-turbo")
-        
-        template = """
-            You are a financial advisor. Based on previous advice and user feedback, focus on incorporating the feedback given. Provide updated financial advice. Keep your advice concise, highly personalized and actionable, ensuring it does not exceed 1000 characters.
-            {history}
-            Human: {input}
-        """
-        prompt_template = PromptTemplate(input_variables=["input"], template=template)
-        memory_data = self.get_memory_from_mongodb('JasEmm', db)
-        memory = ConversationBufferMemory(memory_key="history", buffer=memory_data)
+        cache_key = hashlib.sha256(f"{feedback}\0{data}".encode()).hexdigest()
+        openai_secret_key, memory_data, cached = await asyncio.gather(openai_secret_key_task, self.get_memory_from_mongodb('JasEmm', db), self.get_cached_advice(cache_key, db))
+        if cached:
+            return orjson.dumps({'advice': cached}).decode()
+        openai = _get_llm(openai_secret_key)
 
         context = {
-            "input": f"Here is this week's spending data: {transaction_data[current_week_key]}, and previous data: {previous_weeks_data}. feedback: {feedback}",
+            "input": f"Here is this week's spending data: {current_week_data}, and previous data: {previous_weeks_data}. feedback: {feedback}",
         }
-        memory_variables = memory.load_memory_variables(inputs=context)
-        context["history"] = memory_variables.get("history", "")
+        context["history"] = self.build_history(memory_data)
 
-        conversation = ConversationChain(prompt=prompt_template, llm=openai, memory=memory)
         try:
-            updated_response = conversation.predict(input=context["input"], history=context["history"])
-            memory.save_context(inputs={"input": context["input"]}, outputs={"history": updated_response})
+            updated_response = (await openai.ainvoke(UPDATE_PROMPT.format_messages(**context))).content
 
             new_memory_data = [
                 {"role": "human", "feedback": feedback},
                 {"role": "ai", "content": updated_response}
             ]
-            self.save_memory_to_mongodb('JasEmm', new_memory_data, "conversational", db)
+            embeddings = _get_embeddings(openai_secret_key)
+            for entry, embedding in zip(new_memory_data, await embeddings.aembed_documents([feedback, updated_response])):
+                entry["embedding"] = embedding
+            await self.save_memory_to_mongodb('JasEmm', new_memory_data, "conversational", db)
+            await self.cache_advice(cache_key, updated_response, db)
 
-            return json.dumps({'advice': updated_response})
+            return orjson.dumps({'advice': updated_response}).decode()
         except Exception as e:
             return str(e)
 
+    @function
+    async def create_indexes(self, connection: Secret) -> str:
+        """Creates the (type, key) lookup index and the ts TTL index used by the advice cache. Run once per database."""
+        connection_string = await connection.plaintext()
+        db = self.authenticate(connection_string, 'financials', 'memory')
+        await db.create_indexes([
+            IndexModel([("type", ASCENDING), ("key", ASCENDING)]),
+            IndexModel("ts", expireAfterSeconds=RESPONSE_CACHE_TTL, partialFilterExpression={"type": "response_cache"})
+        ])
+        return 'Success'
+
     def authenticate(self, connection_string: str, database: str, collection: str):
-        """Authenticates with MongoDB and returns a reference to the transactions collection."""
-        max_retries = 3
-        retries = 0
-        while retries < max_retries:
-            try:
-                client = pymongo.MongoClient(connection_string)
-                db = client[database]
-                return db[collection]
-            except AutoReconnect as e:
-                retries += 1
-                if retries == max_retries:
-                    raise OperationFailure(f"Failed to connect to MongoDB after {max_retries} retries: {e}")
-            except OperationFailure as e:
-                raise OperationFailure(f"Failed to authenticate with MongoDB: {e}")
+        """Returns a reference to the memory collection on a client shared across calls."""
+        return _get_client(connection_string)[database][collection]
     
-    def save_memory_to_mongodb(self, user_id: str, data: dict, data_type: str, db:Collection) -> None:
+    async def get_cached_advice(self, cache_key: str, db: AsyncIOMotorCollection) -> str:
+        """Returns advice already generated for the same feedback and data within RESPONSE_CACHE_TTL seconds, if any."""
+        cached = await db.find_one({"type": "response_cache", "key": cache_key, "ts": {"$gt": datetime.now(timezone.utc) - timedelta(seconds=RESPONSE_CACHE_TTL)}})
+        return cached["advice"] if cached else None
+
+    async def cache_advice(self, cache_key: str, advice: str, db: AsyncIOMotorCollection) -> None:
+        """Stores generated advice under its cache key; the TTL index from create_indexes removes stale entries."""
+        await db.update_one(
+            {"type": "response_cache", "key": cache_key},
+            {"$set": {"advice": advice, "ts": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+    def build_history(self, memory_data: dict, query_embedding: list[float] = None) -> list[BaseMessage]:
+        """Builds the prompt history from MEMORY_WINDOW_TURNS exchanges of the stored conversation: the most relevant to query_embedding if given, otherwise the most recent."""
+        entries = memory_data["conversational"]
+        if query_embedding is not None:
+            entries = self.select_relevant_entries(entries, query_embedding)
+        return [
+            HumanMessage(content=entry.get("content") or entry.get("feedback", "")) if entry.get("role") == "human" else AIMessage(content=entry.get("content", ""))
+            for entry in entries[-2 * MEMORY_WINDOW_TURNS:]
+        ]
+
+    def select_relevant_entries(self, entries: list[dict], query_embedding: list[float]) -> list[dict]:
+        """Keeps the stored entries most similar to the query, in their original order. Entries saved before embeddings were stored rank last, most recent first."""
+        scored = [(_cosine_similarity(entry["embedding"], query_embedding) if "embedding" in entry else -1.0, index) for index, entry in enumerate(entries)]
+        keep = sorted(index for _, index in heapq.nlargest(2 * MEMORY_WINDOW_TURNS, scored))
+        return [entries[index] for index in keep]
+
+    async def save_memory_to_mongodb(self, user_id: str, data: dict, data_type: str, db: AsyncIOMotorCollection) -> None:
         """
-        Saves or updates the user input or appends new memory data for a given user in MongoDB.
+        Saves or updates the user input, or appends new memory data for a given user in MongoDB with a server-side $push.
 
         Args:
             user_id (str): The ID of the user.
             data (dict): The data to be saved.
-            data_type (str): The type of data ('user_input' or 'memory').
-            db (Collection): The MongoDB collection.
+            data_type (str): The type of data ('current_data' or 'conversational').
+            db (AsyncIOMotorCollection): The MongoDB collection.
         """
+        await db.bulk_write([self.memory_operation(user_id, data, data_type)])
+
+    def memory_operation(self, user_id: str, data: dict, data_type: str) -> UpdateOne:
+        """Builds the upsert that stores the user input ('current_data') or appends conversation turns ('conversational')."""
         if data_type == "current_data":
-            db.update_one(
-                {"current_data": user_id, "type": data_type},
-                {"$set": {"content": data}},
-                upsert=True
-            )
-        elif data_type == "conversational":
-            existing_memory = self.get_memory_from_mongodb(user_id, db)["conversational"]
-            updated_memory = existing_memory + data
-            db.update_one(
-                {"user_id": user_id, "type": data_type},
-                {"$set": {"content": updated_memory}},
-                upsert=True
-            )
+            return UpdateOne({"current_data": user_id, "type": data_type}, {"$set": {"content": data}}, upsert=True)
+        if data_type == "conversational":
+            return UpdateOne({"user_id": user_id, "type": data_type}, {"$push": {"content": {"$each": data}}}, upsert=True)
+        raise ValueError(f"Unknown memory data type: {data_type}")
     
-    def get_memory_from_mongodb(self, user_id: str, db: Collection) -> list[dict]:
+    async def get_memory_from_mongodb(self, user_id: str, db: AsyncIOMotorCollection, limit: int = 2 * MEMORY_WINDOW_TURNS) -> list[dict]:
         """
-        Fetches the memory data and user input for a given user from MongoDB.
+        Fetches the memory data and user input for a given user from MongoDB, keeping only the most recent entries.
 
         Args:
             user_id (str): The ID of the user.
-            db (Collection): The MongoDB collection.
+            db (AsyncIOMotorCollection): The MongoDB collection.
+            limit (int): How many of the most recent conversation entries to fetch.
 
         Returns:
             dict: A dictionary containing the user input and memory data.
         """
-        current_data = db.find_one({"user_id": user_id, "type": "current_data"})
-        conversational = db.find_one({"user_id": user_id, "type": "conversational"})
+        documents = {document["type"]: document async for document in db.find({"user_id": user_id, "type": {"$in": ["current_data", "conversational"]}}, {"content": {"$slice": -limit}})}
         return {
-            "current_data": current_data.get("content") if current_data else "",
-            "conversational": conversational.get("content") if conversational else []
+            "current_data": documents.get("current_data", {}).get("content", ""),
+            "conversational": documents.get("conversational", {}).get("content", [])
         }
         
 
@@ -24,10 +24,41 @@ This module simplifies complex financial data aggregation tasks and presents the
 """
 
 from dagger import function, object_type, Secret
-import json
-import pymongo
-from pymongo.errors import AutoReconnect, OperationFailure
-from datetime import datetime
+import orjson
+from motor.motor_asyncio import AsyncIOMotorClient
+import functools
+
+def _date_part(parts: dict, index: int) -> dict:
+    """Picks one '/'-separated part of a week string, zero-padded to two digits."""
+    part = {"$ifNull": [{"$arrayElemAt": [parts, index]}, ""]}
+    return {"$cond": [{"$eq": [{"$strLenCP": part}, 1]}, {"$concat": ["0", part]}, part]}
+
+WEEK_PARTS = {"$split": ["$_id", "/"]}
+
+# Weeks are stored either as dates or as "%m/%d/%y" strings; strings that don't parse become null and are dropped.
+WEEK_DATE = {
+    "$switch": {
+        "branches": [
+            {"case": {"$eq": [{"$type": "$_id"}, "date"]}, "then": "$_id"},
+            {"case": {"$eq": [{"$type": "$_id"}, "string"]}, "then": {
+                "$dateFromString": {
+                    "dateString": {"$concat": [
+                        _date_part(WEEK_PARTS, 0), "/", _date_part(WEEK_PARTS, 1), "/",
+                        {"$cond": [{"$lt": [_date_part(WEEK_PARTS, 2), "69"]}, "20", "19"]}, _date_part(WEEK_PARTS, 2)
+                    ]},
+                    "format": "%m/%d/%Y",
+                    "onError": None,
+                    "onNull": None
+                }
+            }}
+        ],
+        "default": None
+    }
+}
+
+@functools.lru_cache(maxsize=4)
+def _get_client(connection_string: str) -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(connection_string, maxPoolSize=10, retryWrites=True, retryReads=True, serverSelectionTimeoutMS=3000)
 
 @object_type
 class GetFromMongo:
@@ -63,47 +94,38 @@ class GetFromMongo:
             },
             {
                 "$sort": {"_id": -1} 
+            },
+            {
+                "$addFields": {"WeekDate": WEEK_DATE}
+            },
+            {
+                "$match": {"WeekDate": {"$ne": None}}
+            },
+            {
+                "$project": {
+                    "_id": 0,
+                    "Week": {"$dateToString": {"format": "%Y-%m-%d", "date": "$WeekDate"}},
+                    "Categories": {
+                        "$arrayToObject": {
+                            "$map": {
+                                "input": "$Categories",
+                                "as": "c",
+                                "in": {
+                                    "k": {"$toString": {"$ifNull": ["$$c.Category", "null"]}},
+                                    "v": {"Transactions": "$$c.Transactions", "Total": "$$c.Total"}
+                                }
+                            }
+                        }
+                    },
+                    "TotalWeek": 1
+                }
             }
         ]
         connection_string = await connection.plaintext()
         db = self.authenticate(connection_string, database, collection)
-        aggregatedData = list(db.aggregate(pipeline))
-        response = {}
-        for week_data in aggregatedData:
-            week_id = week_data['_id']
-            if isinstance(week_id, str):
-                try:
-                    week_id = datetime.strptime(week_id, "%m/%d/%y")
-                except ValueError:
-                    continue
-            week_str = "Week: " + week_id.strftime("%Y-%m-%d")
-            categories = week_data.get("Categories", [])
-            total_week = week_data.get("TotalWeek", 0)
-            categories_data = {}
-            for category_data in categories:
-                category = category_data["Category"]
-                transactions = category_data["Transactions"]
-                total_category = category_data["Total"]
-                categories_data[category] = {
-                    "Transactions": transactions,
-                    "Total": total_category
-                }
-            response[week_str] = {"Categories": categories_data, "TotalWeek": total_week}
-        json_response = json.dumps(response)
-        return json_response
+        response = {"Week: " + week_data["Week"]: {"Categories": week_data["Categories"], "TotalWeek": week_data["TotalWeek"]} async for week_data in db.aggregate(pipeline, batchSize=50, allowDiskUse=True)}
+        return orjson.dumps(response, option=orjson.OPT_NON_STR_KEYS).decode()
 
     def authenticate(self, connection_string: str, database: str, collection: str):
-        """Authenticates with MongoDB and returns a reference to the transactions collection."""
-        max_retries = 3
-        retries = 0
-        while retries < max_retries:
-            try:
-                client = pymongo.MongoClient(connection_string)
-                db = client[database]
-                return db[collection]
-            except AutoReconnect as e:
-                retries += 1
-                if retries == max_retries:
-                    raise OperationFailure(f"Failed to connect to MongoDB after {max_retries} retries: {e}")
-            except OperationFailure as e:
-                raise OperationFailure(f"Failed to authenticate with MongoDB: {e}")
+        """Returns a reference to the transactions collection on a client shared across calls."""
+        return _get_client(connection_string)[database][collection]
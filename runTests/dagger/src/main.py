@@ -38,11 +38,13 @@ class RunTests:
     @function
     async def build_test(self, src: dagger.Directory, repo: str, tag: str) -> str:
         image_address = f"docker.io/{repo}:{tag}"
+        npm_cache = dag.cache_volume("npm-cache")
         return await (
             dag.container()
             .from_(image_address)
+            .with_mounted_cache("/root/.npm", npm_cache)
             .with_mounted_directory("/app", src)
-            .with_exec(["sh", "-c", "npm install @rollup/rollup-linux-arm64-gnu || true"])
+            .with_exec(["sh", "-c", "npm install --prefer-offline @rollup/rollup-linux-arm64-gnu || true"])
             .with_exec(["sh", "-c", "npm run test 2>&1"])
             .stdout()
         )
@@ -16,26 +16,26 @@ if appropriate. All modules should have a short description.
 import dagger
 from dagger import dag, function, object_type
 
+SECTORS_OF_INTEREST = "Health Care,Information Technology,Financials,Energy"
+PERIOD = 2
+
 
 @object_type
 class Vcstockbrain:
     @function
     async def run(self) -> str:
         """Returns a container that echoes whatever string argument is provided"""
-        sectors_of_interest = "Health Care, Information Technology, Financials, and Energy"
-        period = 2
-        top = 5
-        stocks_data = await dag.get_stocks().stocks(sectors_of_interest, period, top)
+        stocks_data = await dag.get_stocks().stocks(SECTORS_OF_INTEREST, PERIOD)
         return stocks_data
 
     @function
-    async def update(self, directory_arg: dagger.Directory, pattern: str) -> str:
-        """Returns lines that match a pattern in the files of the provided Directory"""
+    async def update(self, directory_arg: dagger.Directory, pattern: str, files_only: bool = False) -> str:
+        """Returns lines that match a pattern in the files of the provided Directory, or only the names of matching files when files_only is set"""
         return await (
             dag.container()
             .from_("alpine:latest")
             .with_mounted_directory("/mnt", directory_arg)
             .with_workdir("/mnt")
-            .with_exec(["grep", "-R", pattern, "."])
+            .with_exec(["grep", "-lR" if files_only else "-R", pattern, "."])
             .stdout()
         )
@@ -7,8 +7,9 @@ The primary function write is responsible for connecting to MongoDB using a prov
 
 Functions:
 
-- authenticate: A utility function that authenticates with MongoDB using the provided connection string and returns a reference to the specified collection. This function manages connection retries and handles potential connection errors, ensuring a reliable connection to the database.
+- authenticate: A utility function that returns a reference to the specified collection. The MongoClient is created once per connection string and reused, so repeated calls share its connection pool; retries are left to the driver.
 - write: The main function of the module, which parses the transaction data and performs upsert operations on the MongoDB collection. It ensures that each transaction is processed correctly, updating existing records or inserting new ones as needed.
+- create_indexes: Creates the index on Transaction ID that write's upserts and FilterForNewTransactions' lookups rely on. Run it once when setting up a collection; write does not create indexes itself.
 
 Args:
 
@@ -18,24 +19,38 @@ Args:
 - collection (str): The specific collection within the database where transaction data will be written.
 
 Return:
-The write function returns a JSON string representing the transactions that were processed. This includes the original transaction data, ensuring that the calling process can verify the records that were attempted to be written to the database.
+The write function returns a JSON summary of the write, e.g. {"matched": 10, "modified": 4, "upserted": 2, "skipped": 1}. "skipped" counts transactions without a Transaction ID.
 
 Example Call:
 dagger call write --transactions='[{"Transaction ID": "12345", "Amount": 100, "Description": "Grocery"}]' --connection=env:[KEY] --database=[DBNAME] --collection=[COLLECTIONNAME]
+dagger call create_indexes --connection=env:[KEY] --database=[DBNAME] --collection=[COLLECTIONNAME]
 
 Usage
 This module streamlines the process of writing transaction data to MongoDB, handling all necessary authentication and ensuring data integrity through upsert operations. It is particularly useful for applications that need to regularly update transaction records in a MongoDB database, such as financial tracking systems or expense management applications.
 
 Detailed Functionality
-authenticate: Manages the connection to MongoDB, implementing retries to handle transient connection issues. This function raises an OperationFailure if it fails to connect after the maximum number of retries, ensuring that calling functions can handle this failure appropriately.
-write: Parses the transaction data from a JSON string, iterates over each transaction, and performs an upsert operation on the MongoDB collection. It ensures that each transaction is uniquely identified by its Transaction ID and updates the existing document or inserts a new one as needed.
+authenticate: Hands out collections from a MongoClient cached per connection string, with wire compression enabled and retryable reads and writes handled by the driver.
+write: Parses the transaction data from a JSON string, iterates over each transaction, and performs an upsert operation on the MongoDB collection. The payload is stream-parsed and upserted with unordered bulk_writes of WRITE_BATCH_SIZE. Since items are validated as they stream, a payload that is malformed JSON or contains a non-object item fails with a RuntimeError after any earlier batches have been written; those writes are upserts, so the payload can be corrected and resent. It ensures that each transaction is uniquely identified by its Transaction ID and updates the existing document or inserts a new one as needed.
 """
 
 import dagger
 from dagger import dag, function, object_type, Secret
-import pymongo
-from pymongo.errors import AutoReconnect, OperationFailure
-import json
+from motor.motor_asyncio import AsyncIOMotorClient
+import functools
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+import ijson
+import orjson
+import asyncio
+import io
+from itertools import islice
+
+WRITE_BATCH_SIZE = 500
+MAX_CONCURRENT_WRITES = 8
+
+@functools.lru_cache(maxsize=4)
+def _get_client(connection_string: str) -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(connection_string, maxPoolSize=50, retryWrites=True, retryReads=True, serverSelectionTimeoutMS=5000, compressors="zstd,zlib")
 
 @object_type
 class WriteToMongo:
@@ -44,36 +59,75 @@ class WriteToMongo:
         """Writes processed data back to MongoDB."""
         connection_string = await connection.plaintext()
         transactions_collection = self.authenticate(connection_string, database, collection)
-        parsed_data = json.loads(transactions)
-        try:
-            for transaction in parsed_data:
-                transaction_id = transaction.get('Transaction ID')
-                if not transaction:
-                    print("Skipping transaction without Transaction ID")
+        skipped = 0
+
+        def with_transaction_ids(items):
+            nonlocal skipped
+            for transaction in items:
+                if not isinstance(transaction, dict):
+                    raise ValueError(f"Expected each transaction to be a JSON object, got {type(transaction).__name__}")
+                if not transaction.get('Transaction ID'):
+                    skipped += 1
                     continue
-                update_document = {"$set": {key: value for key, value in transaction.items() if key}}
-                transactions_collection.update_one(
-                    filter={'Transaction ID': transaction_id},
-                    update=update_document,
-                    upsert=True
-                )
-        except RuntimeError as e:
+                transaction.pop('', None)
+                yield transaction
+
+        documents = with_transaction_ids(ijson.items(io.BytesIO(transactions.encode()), 'item', use_float=True))
+        try:
+            summary = await self.upsert_in_batches(transactions_collection, documents)
+        except (ValueError, ijson.JSONError) as e:
+            raise RuntimeError(f"Failed to write to MongoDB, batches before the invalid transaction may already be written: {e}") from e
+        except BulkWriteError as e:
+            raise RuntimeError(f"Failed to write to MongoDB: {e.details.get('writeErrors')}") from e
+        except (RuntimeError, PyMongoError) as e:
                 raise RuntimeError("Failed to write to MongoDB") from e
+        if skipped:
+            print(f"Skipped {skipped} transactions without Transaction ID")
+        summary["skipped"] = skipped
+        return orjson.dumps(summary).decode()
+
+    def batches(self, documents):
+        """Yields lists of up to WRITE_BATCH_SIZE documents from the stream."""
+        while True:
+            batch = list(islice(documents, WRITE_BATCH_SIZE))
+            if not batch:
+                return
+            yield batch
+
+    async def write_batches(self, documents, write_batch) -> list:
+        """Runs write_batch over the streamed batches, keeping up to MAX_CONCURRENT_WRITES of them in flight at once, and returns their results."""
+        batches = self.batches(documents)
+        results = []
+        while True:
+            window = list(islice(batches, MAX_CONCURRENT_WRITES))
+            if not window:
+                return results
+            results.extend(await asyncio.gather(*(write_batch(batch) for batch in window)))
+
+    async def upsert_in_batches(self, transactions_collection, documents) -> dict:
+        """Upserts the streamed documents by Transaction ID, one unordered bulk_write per batch, and totals the matched, modified and upserted counts."""
+        upsert_operation = self.upsert_operation
+        bulk_write = transactions_collection.bulk_write
+        results = await self.write_batches(documents, lambda batch: bulk_write(list(map(upsert_operation, batch)), ordered=False))
+        return {
+            "matched": sum(result.matched_count for result in results),
+            "modified": sum(result.modified_count for result in results),
+            "upserted": sum(result.upserted_count for result in results)
+        }
+
+    def upsert_operation(self, document: dict) -> UpdateOne:
+        """Upserts a document by Transaction ID; the ID is matched by the filter, so it is left out of $set."""
+        transaction_id = document.pop('Transaction ID')
+        update = {"$set": document} if document else {"$setOnInsert": {'Transaction ID': transaction_id}}
+        return UpdateOne({'Transaction ID': transaction_id}, update, upsert=True)
+
+    @function
+    async def create_indexes(self, connection: Secret, database: str, collection: str) -> str:
+        """Indexes Transaction ID so upserts and lookups by ID do not scan the collection. Run once per collection."""
+        connection_string = await connection.plaintext()
+        await self.authenticate(connection_string, database, collection).create_index('Transaction ID')
         return 'Success'
 
     def authenticate(self, connection_string: str, database: str, collection: str):
-        """Authenticates with MongoDB and returns a reference to the transactions collection."""
-        max_retries = 3
-        retries = 0
-        while retries < max_retries:
-            try:
-                client = pymongo.MongoClient(connection_string)
-                db = client[database]
-                return db[collection]
-            except AutoReconnect as e:
-                retries += 1
-                if retries == max_retries:
-                    raise OperationFailure(f"Failed to connect to MongoDB after {max_retries} retries: {e}")
-            except OperationFailure as e:
-                raise OperationFailure(f"Failed to authenticate with MongoDB: {e}")
-
+        """Returns a reference to the transactions collection on a client shared across calls."""
+        return _get_client(connection_string)[database][collection]